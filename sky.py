@@ -6,18 +6,36 @@ Deploy: Render/Termux
 """
 
 import os
+import io
 import asyncio
+import functools
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
+import random
+import re
+import shelve
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from typing import Optional
+from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
 
 # Import libraries
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
-import requests
-from pytube import YouTube
-import openai
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, CallbackContext, CallbackQueryHandler
+from aiolimiter import AsyncLimiter
+import aiohttp
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from cachetools import TTLCache
+import yt_dlp
+from openai import AsyncOpenAI
 import google.generativeai as genai
 from twilio.rest import Client
 
@@ -32,18 +50,47 @@ TWILIO_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_WHATSAPP = os.getenv("TWILIO_WHATSAPP_NUMBER")
 WEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+REDIS_URL = os.getenv("REDIS_URL")
 ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id]
 
 # Initialize APIs
-openai.api_key = OPENAI_API_KEY
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 genai.configure(api_key=GEMINI_API_KEY)
 twilio_client = Client(TWILIO_SID, TWILIO_TOKEN) if TWILIO_SID and TWILIO_TOKEN else None
+GEMINI_MODEL = genai.GenerativeModel('gemini-pro') if GEMINI_API_KEY else None
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# Shared HTTP session (created in post_init, closed in post_shutdown)
+aiohttp_session: Optional[aiohttp.ClientSession] = None
+
+# ==================== REQUEST COALESCING ====================
+# Identical upstream calls in flight share one future
+inflight: dict[tuple, asyncio.Future] = {}
+
+async def coalesce(key: tuple, coro_factory):
+    """Run coro_factory() once per key; concurrent callers await the same result"""
+    fut = inflight.get(key)
+    if fut:
+        return await asyncio.shield(fut)
+    fut = asyncio.ensure_future(coro_factory())
+    inflight[key] = fut
+    try:
+        return await asyncio.shield(fut)
+    finally:
+        if inflight.get(key) is fut:
+            del inflight[key]
 
 # ==================== AI CHAT FUNCTIONS ====================
 async def chat_gpt(prompt: str) -> str:
     """OpenAI ChatGPT response"""
+    return await coalesce(("chatgpt", prompt), lambda: fetch_chat_gpt(prompt))
+
+async def fetch_chat_gpt(prompt: str) -> str:
+    """Call OpenAI ChatGPT"""
     try:
-        response = openai.chat.completions.create(
+        if not openai_client:
+            return "❌ ChatGPT not configured. Add OPENAI_API_KEY."
+        response = await openai_client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=500
@@ -54,40 +101,205 @@ async def chat_gpt(prompt: str) -> str:
 
 async def gemini_chat(prompt: str) -> str:
     """Google Gemini response"""
+    return await coalesce(("gemini", prompt), lambda: fetch_gemini(prompt))
+
+async def fetch_gemini(prompt: str) -> str:
+    """Call Google Gemini"""
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
+        if not GEMINI_MODEL:
+            return "❌ Gemini not configured. Add GEMINI_API_KEY."
+        response = await GEMINI_MODEL.generate_content_async(prompt)
         return response.text
     except Exception as e:
         return f"🤖 Gemini Error: {str(e)}"
 
+def chunk(text: str, n: int = 4000):
+    """Split text into pieces that fit Telegram's 4096-char message limit"""
+    return (text[i:i + n] for i in range(0, len(text), n))
+
+async def reply_chunks(update: Update, text: Optional[str]):
+    """Send a long reply as several messages, in order"""
+    if not text:
+        await update.message.reply_text("🤖 No response received. Please try again.")
+        return
+    for part in chunk(text):
+        await update.message.reply_text(part)
+
 # ==================== DOWNLOADER FUNCTIONS ====================
-async def download_youtube(url: str, quality: str = "medium"):
-    """Download YouTube video/audio"""
+YOUTUBE_URL_RE = re.compile(r'^(https?://)?(www\.|m\.|music\.)?(youtube\.com|youtu\.be)/')
+
+# Resolved (selected format info, filename) per (video id, quality) for 30 min
+youtube_cache = TTLCache(maxsize=256, ttl=1800)
+
+def youtube_video_id(url: str) -> str:
+    """Extract canonical video id from a YouTube URL"""
+    parsed = urlparse(url)
+    if parsed.hostname and parsed.hostname.endswith("youtu.be"):
+        return parsed.path.lstrip("/")
+    video_id = parse_qs(parsed.query).get("v")
+    return video_id[0] if video_id else url
+
+# yt-dlp options; aria2c splits downloads into parallel range requests when installed
+YDL_FORMATS = {
+    "audio": "bestaudio[ext=m4a]/bestaudio",
+    "medium": "best[ext=mp4]/best",
+}
+YDL_OPTS = {
+    "noplaylist": True,  # watch?v=ID&list=... downloads just the video
+    "quiet": True,
+    "noprogress": True,
+}
+if shutil.which("aria2c"):
+    YDL_OPTS["external_downloader"] = {"default": "aria2c"}
+    YDL_OPTS["external_downloader_args"] = {"aria2c": ["-x", "16", "-s", "16", "-k", "1M"]}
+
+# yt-dlp is fully synchronous; keep it off the event loop
+download_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="youtube")
+
+def _ydl(quality: str, outdir: str = "downloads") -> yt_dlp.YoutubeDL:
+    """yt-dlp instance for the given quality, saving into outdir"""
+    return yt_dlp.YoutubeDL({
+        **YDL_OPTS,
+        "format": YDL_FORMATS.get(quality, YDL_FORMATS["medium"]),
+        "outtmpl": f"{outdir}/%(id)s.%(ext)s",
+    })
+
+# Only the selected format is cached; the full info dict (all formats,
+# captions, thumbnails) can be ~1 MB per video
+YDL_INFO_KEYS = (
+    "id", "title", "ext", "url", "protocol", "format_id", "vcodec", "acodec",
+    "filesize", "filesize_approx", "http_headers", "downloader_options",
+    "extractor", "extractor_key", "webpage_url",
+)
+
+def _resolve_stream(url: str, quality: str):
+    """Extract video metadata and pick format (blocking)"""
+    with _ydl(quality) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    if info.get("_type") == "playlist":
+        raise ValueError("Playlists are not supported. Send a single video link.")
+    info = {k: info[k] for k in YDL_INFO_KEYS if k in info}
+    filename = f"{info['title'][:50]}.{info['ext']}"
+    return info, filename
+
+def _sync_download(info: dict, quality: str, outdir: str) -> str:
+    """Download resolved video into outdir (blocking)"""
+    with _ydl(quality, outdir) as ydl:
+        ydl.process_ie_result(info, download=True)
+        return ydl.prepare_filename(info)
+
+# Telegram bot API upload cap; larger media is rejected before downloading
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Media up to this size is fetched into memory and uploaded without touching
+# disk; at most 4 buffers are held at once (~80 MB). Larger media goes
+# through yt-dlp/aria2c into a temp directory.
+MEMORY_UPLOAD_LIMIT = 20 * 1024 * 1024
+memory_upload_slots = asyncio.Semaphore(4)
+
+def too_large_message(size: int) -> str:
+    """User-facing error for media over the upload cap"""
+    return f"❌ File too large ({size / (1024 * 1024):.0f} MB). Telegram bots can only send up to 50 MB."
+
+async def resolve_youtube(url: str, quality: str = "medium"):
+    """Resolve (format info, filename) for a video, cached per video id"""
+    loop = asyncio.get_running_loop()
+    key = (youtube_video_id(url), quality)
+    cached = youtube_cache.get(key)
+    if cached:
+        return cached
+    
+    resolved = await coalesce(
+        ("youtube", *key),
+        lambda: loop.run_in_executor(download_executor, _resolve_stream, url, quality)
+    )
+    youtube_cache[key] = resolved
+    return resolved
+
+async def fetch_to_buffer(info: dict) -> io.BytesIO:
+    """Download media into memory in ranged chunks (unranged GETs get throttled)"""
+    chunk_size = (info.get("downloader_options") or {}).get("http_chunk_size") or 10 * 1024 * 1024
+    buf = io.BytesIO()
+    while True:
+        start = buf.tell()
+        headers = {**(info.get("http_headers") or {}), "Range": f"bytes={start}-{start + chunk_size - 1}"}
+        async with aiohttp_session.get(info["url"], headers=headers) as r:
+            r.raise_for_status()
+            data = await r.read()
+            ranged = r.status == 206
+        buf.write(data)
+        # A 200 means the server ignored Range and sent the whole file
+        if not ranged or len(data) < chunk_size or buf.tell() > TELEGRAM_UPLOAD_LIMIT:
+            break
+    buf.seek(0)
+    return buf
+
+async def download_to_disk(info: dict, quality: str) -> str:
+    """Download media with yt-dlp into a private temp directory"""
+    # Private directory per request so concurrent downloads of the
+    # same video never share (or delete) each other's files
+    outdir = tempfile.mkdtemp(dir="downloads")
     try:
-        yt = YouTube(url)
-        if quality == "audio":
-            stream = yt.streams.filter(only_audio=True).first()
-            filename = f"{yt.title[:50]}.mp3"
-        else:
-            stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-            filename = f"{yt.title[:50]}.mp4"
-        
-        filepath = f"downloads/{filename}"
-        os.makedirs("downloads", exist_ok=True)
-        stream.download(output_path="downloads", filename=filename)
-        return filepath, filename
-    except Exception as e:
-        return None, f"❌ YouTube Error: {str(e)}"
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(download_executor, _sync_download, info, quality, outdir)
+    except Exception:
+        shutil.rmtree(outdir, ignore_errors=True)
+        raise
+
+async def upload_youtube(update: Update, info: dict, filename: str, quality: str) -> Optional[str]:
+    """Download and send media, from memory when small enough; returns file_id"""
+    size = info.get("filesize") or info.get("filesize_approx")
+    if size and size <= MEMORY_UPLOAD_LIMIT and info.get("protocol") in ("http", "https"):
+        async with memory_upload_slots:
+            buf = await fetch_to_buffer(info)
+            return await reply_youtube_media(update, buf, quality, filename)
+    
+    filepath = await download_to_disk(info, quality)
+    try:
+        # Size may have been unknown before downloading; check the real file
+        size = os.path.getsize(filepath)
+        if size > TELEGRAM_UPLOAD_LIMIT:
+            await update.message.reply_text(too_large_message(size))
+            return None
+        with open(filepath, 'rb') as f:
+            return await reply_youtube_media(update, f, quality, filename)
+    finally:
+        shutil.rmtree(os.path.dirname(filepath), ignore_errors=True)
+
+# Telegram file_id per (video id, quality), persisted across restarts
+# (opened once in post_init, closed in post_shutdown)
+FILE_ID_DB = "file_id_cache.db"
+file_id_db: Optional[shelve.Shelf] = None
+
+def file_id_key(url: str, quality: str) -> str:
+    """Persistent cache key for an uploaded YouTube file"""
+    return f"{youtube_video_id(url)}:{quality}"
+
+def load_file_id(url: str, quality: str) -> Optional[str]:
+    """Telegram file_id of a previous upload, if any"""
+    return file_id_db.get(file_id_key(url, quality))
+
+def save_file_id(url: str, quality: str, file_id: Optional[str]):
+    """Remember Telegram file_id so the media is never uploaded twice"""
+    if file_id:
+        file_id_db[file_id_key(url, quality)] = file_id
+
+def forget_file_id(url: str, quality: str):
+    """Drop a file_id Telegram no longer accepts"""
+    file_id_db.pop(file_id_key(url, quality), None)
 
 # ==================== WHATSAPP FUNCTIONS ====================
-def send_whatsapp(to_number: str, message: str) -> str:
+PHONE_RE = re.compile(r'^\+[1-9]\d{1,14}$')  # E.164
+
+async def send_whatsapp(to_number: str, message: str) -> str:
     """Send WhatsApp message via Twilio"""
     try:
         if not twilio_client:
             return "❌ WhatsApp not configured. Add TWILIO credentials."
         
-        message = twilio_client.messages.create(
+        # Twilio SDK uses blocking requests; run it in a worker thread
+        message = await asyncio.to_thread(
+            twilio_client.messages.create,
             body=message,
             from_=TWILIO_WHATSAPP,
             to=f"whatsapp:{to_number}"
@@ -97,86 +309,203 @@ def send_whatsapp(to_number: str, message: str) -> str:
         return f"❌ WhatsApp Error: {str(e)}"
 
 # ==================== WEATHER FUNCTIONS ====================
+CITY_RE = re.compile(r"^[^\W\d_](?:[^\W\d_]|[ ,.'\-]){0,63}$")
+
+WEATHER_TEMPLATE = (
+    "🌤️ Weather in {city}:\n"
+    "• Temperature: {temp}°C\n"
+    "• Condition: {desc}\n"
+    "• Humidity: {humidity}%\n"
+    "• Wind Speed: {wind} m/s"
+)
+
+# Cached values are the final Telegram-ready strings.
+# Fresh results for 5 min, last good result kept 1 h as fallback if upstream fails
+weather_cache = TTLCache(maxsize=1024, ttl=300)
+weather_stale = TTLCache(maxsize=1024, ttl=3600)
+
+async def fetch_weather(city: str) -> Optional[str]:
+    """Fetch and format weather from OpenWeather (None if city not found)"""
+    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={WEATHER_API_KEY}&units=metric"
+    async with aiohttp_session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as r:
+        response = await r.json()
+    
+    if response.get("cod") != 200:
+        return None
+    
+    return WEATHER_TEMPLATE.format(
+        city=city.capitalize(),
+        temp=response["main"]["temp"],
+        desc=response["weather"][0]["description"],
+        humidity=response["main"]["humidity"],
+        wind=response["wind"]["speed"],
+    )
+
 async def get_weather(city: str) -> str:
-    """Get weather information"""
+    """Get weather information (cached per city)"""
+    key = city.strip().lower()
+    cached = weather_cache.get(key)
+    if cached:
+        return cached
+    
+    return await coalesce(("weather", key), lambda: refresh_weather(city, key))
+
+async def refresh_weather(city: str, key: str) -> str:
+    """Fetch weather into cache, falling back to last good value on error"""
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={WEATHER_API_KEY}&units=metric"
-        response = requests.get(url).json()
-        
-        if response.get("cod") != 200:
-            return f"❌ City not found: {city}"
-        
-        temp = response["main"]["temp"]
-        desc = response["weather"][0]["description"]
-        humidity = response["main"]["humidity"]
-        wind = response["wind"]["speed"]
-        
-        return (
-            f"🌤️ Weather in {city.capitalize()}:\n"
-            f"• Temperature: {temp}°C\n"
-            f"• Condition: {desc}\n"
-            f"• Humidity: {humidity}%\n"
-            f"• Wind Speed: {wind} m/s"
-        )
+        result = await fetch_weather(key)
     except Exception as e:
-        return f"❌ Weather Error: {str(e)}"
+        stale = weather_stale.get(key)
+        return stale if stale else f"❌ Weather Error: {str(e)}"
+    
+    if result is None:
+        return f"❌ City not found: {city}"
+    weather_cache[key] = weather_stale[key] = result
+    return result
+
+# ==================== USER FUNCTIONS ====================
+# Chat ids of everyone who has talked to the bot, persisted for /broadcast
+# (opened once in post_init, closed in post_shutdown)
+USERS_DB = "users.db"
+users_db: Optional[shelve.Shelf] = None
+known_users = set()
+
+def load_users():
+    """Open user db and load known user ids"""
+    global users_db
+    users_db = shelve.open(USERS_DB)
+    known_users.update(int(uid) for uid in users_db)
+
+async def track_user(update: Update, context: CallbackContext):
+    """Remember every user that sends an update"""
+    user = update.effective_user
+    if not user or user.id in known_users:
+        return
+    known_users.add(user.id)
+    users_db[str(user.id)] = True
 
-# ==================== GAME FUNCTIONS ====================
-games_db = {}
+def mark_blocked(user_id: int):
+    """Forget a user who blocked the bot"""
+    known_users.discard(user_id)
+    users_db.pop(str(user_id), None)
 
+# ==================== GAME FUNCTIONS ====================
+# Stored in Redis when REDIS_URL is set (shared by all workers), else in memory
+GAME_TTL = 86400
+
+@dataclass(slots=True)
+class GameState:
+    """Per-user number guessing game"""
+    number: int
+    attempts: int = 0
+
+games_db: dict[int, GameState] = {}
+
+async def load_game(user_id: int) -> Optional[GameState]:
+    """Get user's running game, if any"""
+    if not redis_client:
+        return games_db.get(user_id)
+    data = await redis_client.hgetall(f"game:{user_id}")
+    return GameState(int(data["number"]), int(data["attempts"])) if data else None
+
+async def save_game(user_id: int, state: GameState):
+    """Store user's game (expires after a day of inactivity in Redis)"""
+    if not redis_client:
+        games_db[user_id] = state
+        return
+    key = f"game:{user_id}"
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={"number": state.number, "attempts": state.attempts})
+        pipe.expire(key, GAME_TTL)
+        await pipe.execute()
+
+# Increment attempts only while the game still exists, so a guess racing a
+# finished game can't recreate an orphan hash
+RECORD_GUESS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return attempts
+"""
+record_guess_script = redis_client.register_script(RECORD_GUESS_LUA) if redis_client else None
+
+async def record_guess(user_id: int, state: GameState) -> Optional[int]:
+    """Count one more attempt atomically; None if the game is already over"""
+    if not redis_client:
+        if user_id not in games_db:
+            return None
+        state.attempts += 1
+        return state.attempts
+    attempts = await record_guess_script(keys=[f"game:{user_id}"], args=[GAME_TTL])
+    if attempts is None:
+        return None
+    state.attempts = attempts
+    return attempts
+
+async def delete_game(user_id: int) -> bool:
+    """Finish user's game; False if it was already finished"""
+    if not redis_client:
+        return games_db.pop(user_id, None) is not None
+    return await redis_client.delete(f"game:{user_id}") > 0
+
+def game_storage_guard(handler):
+    """Reply with an error instead of failing silently when Redis is down"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, *args):
+        try:
+            await handler(update, *args)
+        except RedisError as e:
+            logging.warning(f"Game storage error for {update.effective_user.id}: {e}")
+            await update.message.reply_text("❌ Game storage is unavailable. Please try again later.")
+    return wrapper
+
+@game_storage_guard
 async def guess_number_game(update: Update, context: CallbackContext):
     """Simple number guessing game"""
     user_id = update.effective_user.id
     
-    if user_id not in games_db:
-        games_db[user_id] = {"number": None, "attempts": 0}
-    
-    if not games_db[user_id]["number"]:
-        import random
-        games_db[user_id]["number"] = random.randint(1, 100)
-        games_db[user_id]["attempts"] = 0
+    state = await load_game(user_id)
+    if state is None:
+        await save_game(user_id, GameState(random.randint(1, 100)))
         await update.message.reply_text("🎮 I've chosen a number between 1-100. Guess it!")
         return
     
+    await play_guess(update, user_id, state)
+
+@game_storage_guard
+async def play_guess(update: Update, user_id: int, state: GameState):
+    """Check a guess against an already loaded game"""
     try:
         guess = int(update.message.text)
-        games_db[user_id]["attempts"] += 1
-        target = games_db[user_id]["number"]
-        
-        if guess < target:
-            await update.message.reply_text("📈 Too low! Try higher.")
-        elif guess > target:
-            await update.message.reply_text("📉 Too high! Try lower.")
-        else:
-            attempts = games_db[user_id]["attempts"]
-            await update.message.reply_text(f"🎉 Correct! You got it in {attempts} attempts!")
-            del games_db[user_id]
-    except:
+    except ValueError:
         await update.message.reply_text("Please send a number!")
-
-# ==================== BOT COMMAND HANDLERS ====================
-async def start(update: Update, context: CallbackContext):
-    """Start command handler"""
-    user = update.effective_user
-    keyboard = [
-        [InlineKeyboardButton("🤖 AI Chat", callback_data='ai_chat'),
-         InlineKeyboardButton("📥 YouTube DL", callback_data='youtube')],
-        [InlineKeyboardButton("🌤️ Weather", callback_data='weather'),
-         InlineKeyboardButton("📱 WhatsApp", callback_data='whatsapp')],
-        [InlineKeyboardButton("🎮 Games", callback_data='games'),
-         InlineKeyboardButton("ℹ️ Help", callback_data='help')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        return
     
-    await update.message.reply_text(
-        f"👋 Hello {user.first_name}! I'm SKY BOT 🤖\n"
-        f"Choose an option below:",
-        reply_markup=reply_markup
-    )
+    attempts = await record_guess(user_id, state)
+    if attempts is None:
+        await update.message.reply_text("🎮 That game is already over. Use /game to play again!")
+        return
+    target = state.number
+    
+    if guess < target:
+        await update.message.reply_text("📈 Too low! Try higher.")
+    elif guess > target:
+        await update.message.reply_text("📉 Too high! Try lower.")
+    elif await delete_game(user_id):
+        # Only the guess that actually ends the game announces the win
+        await update.message.reply_text(f"🎉 Correct! You got it in {attempts} attempts!")
 
-async def help_command(update: Update, context: CallbackContext):
-    """Help command"""
-    help_text = """
+# ==================== BOT COMMAND HANDLERS ====================
+START_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🤖 AI Chat", callback_data='ai_chat'),
+     InlineKeyboardButton("📥 YouTube DL", callback_data='youtube')],
+    [InlineKeyboardButton("🌤️ Weather", callback_data='weather'),
+     InlineKeyboardButton("📱 WhatsApp", callback_data='whatsapp')],
+    [InlineKeyboardButton("🎮 Games", callback_data='games'),
+     InlineKeyboardButton("ℹ️ Help", callback_data='help')]
+])
+
+HELP_TEXT = """
 📚 **SKY BOT COMMANDS**:
 
 🤖 **AI Chat**
@@ -208,7 +537,19 @@ async def help_command(update: Update, context: CallbackContext):
 • `/time` - Current time
 • `/calc <expression>` - Calculator
 """
-    await update.message.reply_text(help_text)
+
+async def start(update: Update, context: CallbackContext):
+    """Start command handler"""
+    user = update.effective_user
+    await update.message.reply_text(
+        f"👋 Hello {user.first_name}! I'm SKY BOT 🤖\n"
+        f"Choose an option below:",
+        reply_markup=START_KEYBOARD
+    )
+
+async def help_command(update: Update, context: CallbackContext):
+    """Help command"""
+    await update.message.reply_text(HELP_TEXT)
 
 async def chatgpt_command(update: Update, context: CallbackContext):
     """ChatGPT command"""
@@ -219,7 +560,18 @@ async def chatgpt_command(update: Update, context: CallbackContext):
     prompt = ' '.join(context.args)
     await update.message.reply_text("🤖 Thinking...")
     response = await chat_gpt(prompt)
-    await update.message.reply_text(response[:4000])
+    await reply_chunks(update, response)
+
+async def reply_youtube_media(update: Update, media, quality: str, filename: Optional[str] = None) -> Optional[str]:
+    """Send audio/video and return its Telegram file_id (None if stored as another type)"""
+    if quality == "audio":
+        msg = await update.message.reply_audio(media, caption="✅ Here's your audio!", filename=filename)
+        sent = msg.audio
+    else:
+        msg = await update.message.reply_video(media, caption="✅ Here's your video!", filename=filename)
+        sent = msg.video
+    # Telegram may store e.g. webm/opus as a document; its id can't be resent as audio/video
+    return sent.file_id if sent else None
 
 async def youtube_command(update: Update, context: CallbackContext):
     """YouTube download command"""
@@ -228,15 +580,35 @@ async def youtube_command(update: Update, context: CallbackContext):
         return
     
     url = context.args[0]
+    if not YOUTUBE_URL_RE.match(url):
+        await update.message.reply_text("❌ Please send a valid YouTube URL.")
+        return
+    if not url.startswith(("http://", "https://")):
+        url = f"https://{url}"
+    quality = "audio" if update.message.text.startswith("/ytaudio") else "medium"
     await update.message.reply_text("📥 Downloading video...")
-    filepath, result = await download_youtube(url)
     
-    if filepath:
-        with open(filepath, 'rb') as video:
-            await update.message.reply_video(video, caption="✅ Here's your video!")
-        os.remove(filepath)
-    else:
-        await update.message.reply_text(result)
+    file_id = load_file_id(url, quality)
+    if file_id:
+        try:
+            await reply_youtube_media(update, file_id, quality)
+            return
+        except BadRequest:
+            # Stale or unusable id (e.g. bot token changed); forget it and re-download
+            forget_file_id(url, quality)
+    
+    try:
+        info, filename = await resolve_youtube(url, quality)
+        size = info.get("filesize") or info.get("filesize_approx")
+        if size and size > TELEGRAM_UPLOAD_LIMIT:
+            await update.message.reply_text(too_large_message(size))
+            return
+        file_id = await upload_youtube(update, info, filename, quality)
+        save_file_id(url, quality, file_id)
+    except TelegramError as e:
+        await update.message.reply_text(f"❌ Upload Error: {str(e)}")
+    except Exception as e:
+        await update.message.reply_text(f"❌ YouTube Error: {str(e)}")
 
 async def whatsapp_command(update: Update, context: CallbackContext):
     """WhatsApp send command"""
@@ -245,8 +617,11 @@ async def whatsapp_command(update: Update, context: CallbackContext):
         return
     
     number = context.args[0]
+    if not PHONE_RE.match(number):
+        await update.message.reply_text("❌ Phone number must be in international format, e.g. +14155552671")
+        return
     message = ' '.join(context.args[1:])
-    result = send_whatsapp(number, message)
+    result = await send_whatsapp(number, message)
     await update.message.reply_text(result)
 
 async def weather_command(update: Update, context: CallbackContext):
@@ -256,9 +631,14 @@ async def weather_command(update: Update, context: CallbackContext):
         return
     
     city = ' '.join(context.args)
+    if not CITY_RE.match(city):
+        await update.message.reply_text(f"❌ Invalid city name: {city[:64]}")
+        return
     weather = await get_weather(city)
     await update.message.reply_text(weather)
 
+BROADCAST_BATCH = 500
+
 async def broadcast_command(update: Update, context: CallbackContext):
     """Admin broadcast"""
     user_id = update.effective_user.id
@@ -271,8 +651,39 @@ async def broadcast_command(update: Update, context: CallbackContext):
         return
     
     message = ' '.join(context.args)
-    # Note: In real implementation, you'd need a user database
-    await update.message.reply_text(f"📢 Broadcast sent: {message}")
+    await update.message.reply_text(f"📢 Broadcasting to {len(known_users)} users...")
+    
+    # Stay under Telegram's 30 msg/s per-bot limit
+    sem = asyncio.Semaphore(30)
+    limiter = AsyncLimiter(25, 1)
+    
+    async def send_one(uid: int) -> bool:
+        async with sem:
+            for attempt in range(2):
+                async with limiter:
+                    try:
+                        await context.bot.send_message(uid, message)
+                        return True
+                    except Forbidden:
+                        mark_blocked(uid)
+                        return False
+                    except RetryAfter as e:
+                        if attempt:
+                            return False
+                        delay = e.retry_after
+                # Flood control: wait as told, then retry once
+                await asyncio.sleep(delay.total_seconds() if isinstance(delay, timedelta) else delay)
+            return False
+    
+    user_ids = list(known_users)
+    sent = 0
+    for i in range(0, len(user_ids), BROADCAST_BATCH):
+        batch = user_ids[i:i + BROADCAST_BATCH]
+        results = await asyncio.gather(*(send_one(uid) for uid in batch), return_exceptions=True)
+        sent += sum(1 for r in results if r is True)
+        await asyncio.sleep(0)  # let polling breathe between batches
+    
+    await update.message.reply_text(f"📢 Broadcast sent to {sent}/{len(user_ids)} users: {message}")
 
 async def button_handler(update: Update, context: CallbackContext):
     """Handle inline keyboard buttons"""
@@ -296,9 +707,15 @@ async def handle_message(update: Update, context: CallbackContext):
     """Handle regular messages with AI"""
     user_id = update.effective_user.id
     
-    # If user is playing game
-    if user_id in games_db and games_db[user_id]["number"]:
-        await guess_number_game(update, context)
+    # If user is playing game (single lookup, reused for the guess);
+    # if Redis is down, treat it as no game so AI chat keeps working
+    try:
+        state = await load_game(user_id)
+    except RedisError as e:
+        logging.warning(f"Game lookup failed for {user_id}: {e}")
+        state = None
+    if state:
+        await play_guess(update, user_id, state)
         return
     
     # Otherwise use AI
@@ -308,12 +725,50 @@ async def handle_message(update: Update, context: CallbackContext):
     
     await update.message.reply_text("🤖 Thinking...")
     response = await gemini_chat(text) if GEMINI_API_KEY else await chat_gpt(text)
-    await update.message.reply_text(response[:4000])
+    await reply_chunks(update, response)
 
 async def error_handler(update: Update, context: CallbackContext):
     """Log errors"""
     logging.error(f"Update {update} caused error {context.error}")
 
+# ==================== LOGGING ====================
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging():
+    """Enqueue log records and write them from a background thread"""
+    global log_listener
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, handler)
+    log_listener.start()
+
+# ==================== LIFECYCLE HOOKS ====================
+async def post_init(app: Application):
+    """Open shared HTTP session, file_id cache and load users"""
+    global aiohttp_session, file_id_db
+    file_id_db = shelve.open(FILE_ID_DB)
+    load_users()
+    connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+    aiohttp_session = aiohttp.ClientSession(connector=connector)
+
+async def post_shutdown(app: Application):
+    """Close shared HTTP session, download workers, shelve dbs, Redis and log listener"""
+    if aiohttp_session:
+        await aiohttp_session.close()
+    download_executor.shutdown(wait=False, cancel_futures=True)
+    if file_id_db is not None:
+        file_id_db.close()
+    if users_db is not None:
+        users_db.close()
+    if redis_client:
+        await redis_client.aclose()
+    if log_listener:
+        log_listener.stop()
+
 # ==================== MAIN FUNCTION ====================
 def main():
     """Start the bot"""
@@ -323,8 +778,34 @@ def main():
         print("💡 Create .env file with: BOT_TOKEN=your_token_here")
         return
     
-    # Create application
-    app = Application.builder().token(BOT_TOKEN).build()
+    # Create application (large HTTP/2 pool for handlers, single connection for polling)
+    request = HTTPXRequest(
+        connection_pool_size=256,
+        pool_timeout=30,
+        read_timeout=30,
+        write_timeout=30,
+        connect_timeout=15,
+        http_version="2",
+    )
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=1,
+        read_timeout=30,
+        write_timeout=30,
+        connect_timeout=15,
+    )
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Track users for broadcast (runs before all other handlers)
+    app.add_handler(TypeHandler(Update, track_user), group=-1)
     
     # Add command handlers
     app.add_handler(CommandHandler("start", start))
@@ -352,13 +833,18 @@ def main():
     print(f"✅ Admin IDs: {ADMIN_IDS}")
     print("📱 Send /start to your bot!")
     
-    # Run bot
+    # Run bot (on uvloop when available; not supported on Windows)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 # ==================== DEPLOYMENT SETUP ====================
 """
 FOR TERMUX:
-1. pkg install python git ffmpeg
+1. pkg install python git ffmpeg aria2
 2. git clone https://github.com/Sky95360/Sky_bot.git
 3. cd Sky_bot
 4. pip install -r requirements.txt
@@ -374,15 +860,23 @@ services:
     startCommand: python bot.py
 
 2. Add requirements.txt with:
-python-telegram-bot
+python-telegram-bot[http2]
 openai
 google-generativeai
-pytube
-requests
+yt-dlp
+aiohttp
+cachetools
+aiolimiter
+redis
 python-dotenv
 twilio
+uvloop; sys_platform != "win32"
 
 3. Set environment variables in Render dashboard
+
+OPTIONAL REDIS (shared game state across workers):
+Set REDIS_URL and configure the server with
+maxmemory-policy allkeys-lfu so memory stays bounded.
 """
 
 if __name__ == '__main__':
@@ -390,10 +884,7 @@ if __name__ == '__main__':
     os.makedirs("downloads", exist_ok=True)
     
     # Set logging
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
+    setup_logging()
     
     # Start bot
     main()